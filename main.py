@@ -1,74 +1,258 @@
 import sys
-import os
+import json
+import time
+import sqlite3
+import threading
 import configparser
-from PyQt6.QtWidgets import (QMainWindow, QMessageBox, QApplication, 
+from collections import OrderedDict
+from contextlib import suppress
+from PyQt6.QtWidgets import (QMainWindow, QMessageBox, QApplication,
                             QLabel, QComboBox, QLineEdit, QPushButton)
 from PyQt6.QtGui import QPixmap
-from PyQt6.QtCore import Qt, pyqtSignal
+from PyQt6.QtCore import (Qt, QObject, QRunnable, QThreadPool, QTimer,
+                          pyqtSignal)
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson разбирает глубокий ответ геокодера в разы быстрее stdlib json
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+
+# Конфиг читается один раз при импорте модуля
+_CFG = configparser.ConfigParser()
+_CFG.read('config.ini')
+_API_KEYS = dict(_CFG['API'])
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=2, backoff_factor=0.2,
+                          status_forcelist=[502, 503, 504])
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Один сеанс на процесс: keep-alive и пул соединений к *.yandex.ru
+_SESSION = _make_session()
+
+
+# Ручной LRU вместо functools.lru_cache: колбэк on_chunk не должен
+# участвовать в ключе кэша
+_MAP_CACHE = OrderedDict()
+_MAP_CACHE_SIZE = 256
+_MAP_CACHE_LOCK = threading.Lock()
+
+
+def _fetch_static_map(url, lon, lat, zoom, map_type, pt_str, on_chunk=None):
+    cache_key = (url, lon, lat, zoom, map_type, pt_str)
+    with _MAP_CACHE_LOCK:
+        if cache_key in _MAP_CACHE:
+            _MAP_CACHE.move_to_end(cache_key)
+            return _MAP_CACHE[cache_key]
+
+    params = {
+        'll': f"{lon},{lat}",
+        'z': zoom,
+        'l': map_type,
+        'size': '650,450'
+    }
+
+    if pt_str:
+        params['pt'] = pt_str
+
+    tile_key = repr((lon, lat, zoom, map_type, pt_str))
+    cached = _CACHE.get_tile(tile_key)
+    headers = {}
+    if cached is not None and cached[0]:
+        headers['If-None-Match'] = cached[0]
+
+    response = _SESSION.get(url, params=params, headers=headers, stream=True)
+    if response.status_code == 304 and cached is not None:
+        data = bytes(cached[1])
+    else:
+        response.raise_for_status()
+        buf = bytearray()
+        for chunk in response.iter_content(16 * 1024):
+            buf.extend(chunk)
+            if on_chunk is not None:
+                on_chunk(bytes(buf))
+        data = bytes(buf)
+        _CACHE.put_tile(tile_key, response.headers.get('ETag', ''), data)
+
+    with _MAP_CACHE_LOCK:
+        _MAP_CACHE[cache_key] = data
+        while len(_MAP_CACHE) > _MAP_CACHE_SIZE:
+            _MAP_CACHE.popitem(last=False)
+    return data
+
+
+class _WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+
+class _Worker(QRunnable):
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.signals = _WorkerSignals()
+        self._fn = fn
+        self._args = args
+
+    def run(self):
+        try:
+            result = self._fn(*self._args)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+class GeocodeCache:
+    def __init__(self, db_path='geocode_cache.db'):
+        # Соединение используется и из рабочих потоков QThreadPool
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocode "
+            "(key TEXT PRIMARY KEY, lon REAL, lat REAL, address TEXT, ts INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS places "
+            "(key TEXT PRIMARY KEY, data TEXT, ts INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tiles "
+            "(key TEXT PRIMARY KEY, etag TEXT, png BLOB, ts INTEGER)"
+        )
+        self.connection.commit()
+
+    def get_geocode(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT lon, lat, address FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'lon': row[0], 'lat': row[1], 'address': row[2]}
+
+    def put_geocode(self, key, result):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                (key, result['lon'], result['lat'], result['address'], int(time.time()))
+            )
+            self.connection.commit()
+
+    def get_places(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM places WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return _json_loads(row[0])
+
+    def put_places(self, key, data):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO places VALUES (?, ?, ?)",
+                (key, json.dumps(data), int(time.time()))
+            )
+            self.connection.commit()
+
+    def get_tile(self, key):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT etag, png FROM tiles WHERE key = ?", (key,)
+            ).fetchone()
+
+    def put_tile(self, key, etag, png):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (key, etag, png, int(time.time()))
+            )
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+# Общий кэш на процесс: к нему обращается и lru-хелпер статической карты
+_CACHE = GeocodeCache('geocode_cache.db')
 
 
 class MapAPI:
-    def __init__(self, config_path='config.ini'):
-        self.config = configparser.ConfigParser()
-        self.config.read(config_path)
-        
-        self.geocoder_key = self.config['API']['geocoder_key']
-        self.places_key = self.config['API']['places_key']
-        
+    def __init__(self):
+        self.geocoder_key = _API_KEYS['geocoder_key']
+        self.places_key = _API_KEYS['places_key']
+
         self.base_geocoder_url = "https://geocode-maps.yandex.ru/1.x"
         self.base_static_map_url = "http://static-maps.yandex.ru/1.x"
         self.base_places_url = "https://search-maps.yandex.ru/v1"
 
+        self.cache = _CACHE
+        self.session = _SESSION
+
     def geocode(self, address, postal_code=False):
+        key = address.strip().lower() + '|' + str(postal_code)
+        cached = self.cache.get_geocode(key)
+        if cached is not None:
+            return cached
+
         params = {
             'geocode': address,
             'apikey': self.geocoder_key,
             'format': 'json',
             'lang': 'ru_RU'
         }
-        
-        response = requests.get(self.base_geocoder_url, params=params)
+
+        response = self.session.get(self.base_geocoder_url, params=params)
         response.raise_for_status()
-        
-        data = response.json()
+
+        data = _json_loads(response.content)
         feature = data['response']['GeoObjectCollection']['featureMember'][0]['GeoObject']
         pos = feature['Point']['pos'].split()
         lon, lat = map(float, pos)
-        
+
         address_info = feature['metaDataProperty']['GeocoderMetaData']
         full_address = address_info['text']
-        
+
         if postal_code:
             postal = address_info['Address'].get('postal_code', '')
             if postal:
                 full_address += f", {postal}"
-                
-        return {
+
+        result = {
             'lon': lon,
             'lat': lat,
             'address': full_address
         }
+        self.cache.put_geocode(key, result)
+        return result
 
-    def get_map_image(self, lon, lat, zoom, map_type, points=None):
-        params = {
-            'll': f"{lon},{lat}",
-            'z': zoom,
-            'l': map_type,
-            'size': '650,450'
-        }
-        
-        if points:
-            params['pt'] = '~'.join(
-                [f"{p['lon']},{p['lat']},pm2{p.get('color', 'bl')}m" 
-                 for p in points]
-            )
-        
-        response = requests.get(self.base_static_map_url, params=params)
-        response.raise_for_status()
-        return response.content
+    def get_map_image(self, lon, lat, zoom, map_type, pt='', on_chunk=None):
+        return _fetch_static_map(
+            self.base_static_map_url, lon, lat, zoom, map_type, pt,
+            on_chunk=on_chunk
+        )
 
     def search_places(self, lon, lat, text):
+        key = f"{text.strip().lower()}|{round(lon, 4)}|{round(lat, 4)}"
+        cached = self.cache.get_places(key)
+        if cached is not None:
+            return cached
+
         params = {
             'apikey': self.places_key,
             'text': text,
@@ -77,14 +261,24 @@ class MapAPI:
             'type': 'biz',
             'results': 1
         }
-        
-        response = requests.get(self.base_places_url, params=params)
+
+        response = self.session.get(self.base_places_url, params=params)
         response.raise_for_status()
-        return response.json()
+
+        data = _json_loads(response.content)
+        self.cache.put_places(key, data)
+        return data
 
 
 class MainWindow(QMainWindow):
     map_updated = pyqtSignal()
+    map_chunk = pyqtSignal(int, bytes)
+
+    _TYPE_MAP = {
+        'Схема': 'map',
+        'Спутник': 'sat',
+        'Гибрид': 'sat,skl'
+    }
     
     def __init__(self):
         super().__init__()
@@ -96,9 +290,29 @@ class MainWindow(QMainWindow):
         self.zoom_level = 12
         self.map_type = 'map'
         self.postal_code = False
-        self.points = []
-        
+        # Точки храним как параллельные массивы (SoA), а не список словарей
+        self._pt_lon = np.empty(0)
+        self._pt_lat = np.empty(0)
+        self._pt_color = np.empty(0, dtype='U8')
+        self._pt_str = ''
+        self._pt_dirty = False
+        # Уже декодированные QPixmap: повторный показ вида из кэша
+        # не платит за PNG-декодирование
+        self._pixmap_cache = OrderedDict()
+        self._last_map_key = None
+        self._pan_epoch = 0
+        self._px2geo = None
+        self._prefetched_places = None
+
+        self.thread_pool = QThreadPool.globalInstance()
         self.map_api = MapAPI()
+
+        # Серия быстрых нажатий/прокруток превращается в один запрос
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(120)
+        self._debounce.timeout.connect(self._do_update_map)
+
         self.update_map()
 
     def setup_ui(self):
@@ -137,19 +351,49 @@ class MainWindow(QMainWindow):
         self.status_label.setGeometry(10, 560, 780, 20)
 
     def setup_map(self):
-        self.temp_map_file = 'temp_map.png'
+        self._map_bytes = None
         self.map_label.setStyleSheet("border: 1px solid #999;")
 
     def setup_connections(self):
         self.type_combo.currentTextChanged.connect(self.change_map_type)
-        self.postal_combo.currentTextChanged.connect(self.toggle_postal_code)
+        self.postal_combo.currentIndexChanged.connect(self.toggle_postal_code)
         self.search_btn.clicked.connect(self.search_location)
         self.search_input.returnPressed.connect(self.search_location)
         self.reset_btn.clicked.connect(self.reset_search_results)
         self.map_updated.connect(self.update_display)
+        self.map_chunk.connect(self._on_map_chunk)
+
+    def add_point(self, lon, lat, color='bl'):
+        self._pt_lon = np.append(self._pt_lon, lon)
+        self._pt_lat = np.append(self._pt_lat, lat)
+        self._pt_color = np.append(self._pt_color, color)
+        self._pt_dirty = True
+
+    def clear_points(self):
+        self._pt_lon = np.empty(0)
+        self._pt_lat = np.empty(0)
+        self._pt_color = np.empty(0, dtype='U8')
+        self._pt_dirty = True
+
+    def _points_param(self):
+        # Строка pt= пересобирается только после мутации точек
+        if self._pt_dirty:
+            if self._pt_lon.size:
+                order = np.lexsort((self._pt_lat, self._pt_lon))
+                pts = np.char.add(self._pt_lon[order].astype('U12'), ',')
+                pts = np.char.add(pts, self._pt_lat[order].astype('U12'))
+                pts = np.char.add(pts, ',pm2')
+                pts = np.char.add(pts, self._pt_color[order])
+                pts = np.char.add(pts, 'm')
+                self._pt_str = '~'.join(pts.tolist())
+            else:
+                self._pt_str = ''
+            self._pt_dirty = False
+        return self._pt_str
 
     def reset_search_results(self):
-        self.points.clear()
+        self.clear_points()
+        self._prefetched_places = None
         self.address_label.setText("Адрес не указан")
         self.search_input.clear()
         self.current_position = {'lon': 37.620070, 'lat': 55.753630}
@@ -157,62 +401,151 @@ class MainWindow(QMainWindow):
         self.update_map()
 
     def change_map_type(self, map_type):
-        type_mapping = {
-            'Схема': 'map',
-            'Спутник': 'sat',
-            'Гибрид': 'sat,skl'
-        }
-        self.map_type = type_mapping.get(map_type, 'map')
+        self.map_type = self._TYPE_MAP.get(map_type, 'map')
         self.update_map()
 
-    def toggle_postal_code(self, state):
-        self.postal_code = (state == 'Показать индекс')
-        if self.points:
+    def toggle_postal_code(self, index):
+        self.postal_code = (index == 1)
+        if self._pt_lon.size:
             self.update_map()
 
+    def _submit(self, fn, args, on_result, on_error):
+        worker = _Worker(fn, *args)
+        worker.signals.finished.connect(on_result)
+        worker.signals.error.connect(on_error)
+        self.thread_pool.start(worker)
+
     def search_location(self):
         query = self.search_input.text()
         if not query:
             return
-            
-        try:
-            result = self.map_api.geocode(query, self.postal_code)
-            self.current_position = {
-                'lon': result['lon'],
-                'lat': result['lat']
-            }
-            self.points = [{
-                'lon': result['lon'],
-                'lat': result['lat'],
-                'color': 'db'
-            }]
-            self.address_label.setText(result['address'])
-            self.zoom_level = 15
-            self.update_map()
-            
-        except Exception as e:
-            self.show_error("Ошибка поиска", str(e))
+
+        self._submit(
+            self.map_api.geocode, (query, self.postal_code),
+            self._on_search_result,
+            lambda msg: self.show_error("Ошибка поиска", msg)
+        )
+
+    def _on_search_result(self, result):
+        self._prefetched_places = None
+        self.current_position = {
+            'lon': result['lon'],
+            'lat': result['lat']
+        }
+        self.clear_points()
+        self.add_point(result['lon'], result['lat'], 'db')
+        self.address_label.setText(result['address'])
+        self.zoom_level = 15
+        self.update_map()
 
     def update_map(self):
-        try:
-            map_image = self.map_api.get_map_image(
-                self.current_position['lon'],
-                self.current_position['lat'],
-                self.zoom_level,
-                self.map_type,
-                self.points
-            )
-            
-            with open(self.temp_map_file, 'wb') as f:
-                f.write(map_image)
-                
-            self.map_updated.emit()
-            
-        except Exception as e:
-            self.show_error("Ошибка карты", str(e))
+        self._debounce.start()
+
+    def _do_update_map(self):
+        map_key = (
+            self.current_position['lon'],
+            self.current_position['lat'],
+            self.zoom_level,
+            self.map_type,
+            self._points_param()
+        )
+        if map_key == self._last_map_key:
+            # На экране уже нужный вид — любой незавершённый запрос
+            # к этому моменту устарел и не должен закоммититься
+            self._pan_epoch += 1
+            return
+
+        self._pan_epoch += 1
+        epoch = self._pan_epoch
+        self._submit(
+            self._fetch_map_progressive,
+            (epoch,) + map_key,
+            lambda data, key=map_key, epoch=epoch:
+                self._on_map_ready(epoch, key, data),
+            lambda msg: self.show_error("Ошибка карты", msg)
+        )
+
+    def _fetch_map_progressive(self, epoch, lon, lat, zoom, map_type, pt):
+        # Выполняется в рабочем потоке; куски изображения уходят в UI
+        # через сигнал map_chunk
+        return self.map_api.get_map_image(
+            lon, lat, zoom, map_type, pt,
+            on_chunk=lambda data: self.map_chunk.emit(epoch, data)
+        )
+
+    def _on_map_chunk(self, epoch, data):
+        if epoch != self._pan_epoch:
+            return
+        # PNG декодируется сверху вниз — частичный буфер уже даёт
+        # верхнюю часть карты
+        pixmap = QPixmap()
+        if pixmap.loadFromData(data, 'PNG'):
+            self.map_label.setPixmap(pixmap)
+
+    def _on_map_ready(self, epoch, map_key, map_image):
+        # Ответ от уже устаревшего запроса игнорируем
+        if epoch != self._pan_epoch:
+            return
+        self._map_bytes = map_image
+        self._last_map_key = map_key
+        self._update_px2geo(map_key[0], map_key[1], map_key[2])
+        self.map_updated.emit()
+        self._prefetch_neighbors(epoch)
+
+    def _update_px2geo(self, lon, lat, zoom):
+        # Аффинное преобразование пиксель -> (lon, lat) для текущего вида;
+        # проекция собрана в одном месте и при клике остаётся один matmul
+        sx = 0.002 * (19 - zoom)
+        sy = 0.001 * (19 - zoom)
+        self._px2geo = np.array([
+            [sx, 0.0, lon - 390 * sx],
+            [0.0, -sy, lat + 225 * sy]
+        ])
+
+    def _prefetch_neighbors(self, epoch):
+        # Прогреваем кэш соседними видами, чтобы следующий шаг
+        # панорамирования или зума отрисовался мгновенно
+        lon = self.current_position['lon']
+        lat = self.current_position['lat']
+        zoom = self.zoom_level
+        step = 0.2 * (1 / zoom)
+        pt_str = self._points_param()
+
+        neighbors = [
+            (lon - step, lat, zoom),
+            (lon + step, lat, zoom),
+            (lon, lat + step, zoom),
+            (lon, lat - step, zoom),
+            (lon, lat, min(zoom + 1, 23)),
+            (lon, lat, max(zoom - 1, 1)),
+        ]
+        for n_lon, n_lat, n_zoom in neighbors:
+            self.thread_pool.start(_Worker(
+                self._prefetch_one, epoch, n_lon, n_lat, n_zoom, pt_str
+            ))
+
+    def _prefetch_one(self, epoch, lon, lat, zoom, pt_str):
+        # Пользователь уже ушёл с этого вида — префетч не нужен
+        if epoch != self._pan_epoch:
+            return None
+        return _fetch_static_map(
+            self.map_api.base_static_map_url,
+            lon, lat, zoom, self.map_type, pt_str
+        )
 
     def update_display(self):
-        pixmap = QPixmap(self.temp_map_file)
+        if self._map_bytes is None:
+            return
+        pixmap = self._pixmap_cache.get(self._last_map_key)
+        if pixmap is None:
+            pixmap = QPixmap()
+            # Явный формат — Qt не тратит время на распознавание
+            pixmap.loadFromData(self._map_bytes, 'PNG')
+            self._pixmap_cache[self._last_map_key] = pixmap
+            while len(self._pixmap_cache) > 32:
+                self._pixmap_cache.popitem(last=False)
+        else:
+            self._pixmap_cache.move_to_end(self._last_map_key)
         self.map_label.setPixmap(pixmap)
         self.status_label.setText(
             f"Координаты: {self.current_position['lon']:.5f}, "
@@ -258,56 +591,78 @@ class MainWindow(QMainWindow):
         img_x = event.pos().x() - self.map_label.x()
         img_y = event.pos().y() - self.map_label.y()
         
+        if self._px2geo is None:
+            return
         if not (0 <= img_x <= 780 and 0 <= img_y <= 450):
             return
-            
-        lon = self.current_position['lon'] + (img_x - 390) * (0.002 * (19 - self.zoom_level))
-        lat = self.current_position['lat'] - (img_y - 225) * (0.001 * (19 - self.zoom_level))
-        
-        try:
-            result = self.map_api.geocode(f"{lon},{lat}", self.postal_code)
-            self.points.append({
-                'lon': result['lon'],
-                'lat': result['lat'],
-                'color': 'db'
-            })
-            self.address_label.setText(result['address'])
-            self.update_map()
-            
-        except Exception as e:
-            self.show_error("Ошибка геокодирования", str(e))
+
+        lon, lat = self._px2geo @ np.array([img_x, img_y, 1.0])
+
+        self._prefetched_places = None
+        self._submit(
+            self.map_api.geocode, (f"{lon},{lat}", self.postal_code),
+            self._on_click_geocode,
+            lambda msg: self.show_error("Ошибка геокодирования", msg)
+        )
+
+    def _on_places_prefetched(self, lon, lat, places):
+        self._prefetched_places = (lon, lat, places)
+
+    def _on_click_geocode(self, result):
+        self.add_point(result['lon'], result['lat'], 'db')
+        self.address_label.setText(result['address'])
+        # Поиск организаций запускаем сразу, как только известен адрес —
+        # тот же запрос, что выполнил бы правый клик, только заранее
+        lon = self.current_position['lon']
+        lat = self.current_position['lat']
+        self._submit(
+            self.map_api.search_places, (lon, lat, result['address']),
+            lambda places, lon=lon, lat=lat:
+                self._on_places_prefetched(lon, lat, places),
+            lambda msg: None
+        )
+        self.update_map()
 
     def handle_right_click(self, event):
         # Поиск организаций
-        if not self.points:
+        if not self._pt_lon.size:
             return
-            
-        try:
-            places = self.map_api.search_places(
-                self.current_position['lon'],
-                self.current_position['lat'],
-                self.address_label.text()
+
+        if self._prefetched_places is not None:
+            pf_lon, pf_lat, places = self._prefetched_places
+            # Заготовка годится, только пока пользователь не ушёл с вида,
+            # для которого она была получена
+            if (pf_lon == self.current_position['lon']
+                    and pf_lat == self.current_position['lat']):
+                self._on_places_result(places)
+                return
+
+        self._submit(
+            self.map_api.search_places,
+            (self.current_position['lon'],
+             self.current_position['lat'],
+             self.address_label.text()),
+            self._on_places_result,
+            lambda msg: self.show_error("Ошибка поиска", msg)
+        )
+
+    def _on_places_result(self, places):
+        if places['features']:
+            place = places['features'][0]
+            name = place['properties']['name']
+            QMessageBox.information(
+                self,
+                "Найдена организация",
+                f"Название: {name}\nАдрес: {place['properties']['description']}"
             )
-            
-            if places['features']:
-                place = places['features'][0]
-                name = place['properties']['name']
-                QMessageBox.information(
-                    self, 
-                    "Найдена организация", 
-                    f"Название: {name}\nАдрес: {place['properties']['description']}"
-                )
-                
-        except Exception as e:
-            self.show_error("Ошибка поиска", str(e))
 
     def show_error(self, title, message):
-        QMessageBox.critical(self, title, 
+        QMessageBox.critical(self, title,
             f"{message}\nПроверьте подключение к интернету и попробуйте снова.")
 
     def closeEvent(self, event):
-        if os.path.exists(self.temp_map_file):
-            os.remove(self.temp_map_file)
+        with suppress(Exception):
+            self.map_api.cache.close()
         event.accept()
 
 